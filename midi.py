@@ -3,52 +3,239 @@
 # http://www.music.mcgill.ca/~ich/classes/mumt306/StandardMIDIfileformat.html
 # https://github.com/colxi/midi-parser-js/wiki/MIDI-File-Format-Specifications
 
-import copy
+import itertools
+import operator
+import struct
 import time
 
 
+# Chunk header layouts (big endian)
+_FILE_HDR = struct.Struct(">4sIHHH")
+_TRACK_HDR = struct.Struct(">4sI")
+_VLQ_WINDOW = struct.Struct(">I")
+
+# Shared byte strings, so hot paths don't build new ones
+_EMPTY = b''
+_ZERO_BYTE = b'\x00'
+_EMPTY_TRACK_HDR = bytes(_TRACK_HDR.size)
+
+# Maps the continuation bits of a 4 byte window to how many bytes the
+# variable int uses and how far to shift the window to drop the rest.
+_VLQ_SHAPES = {}
+for _cont in range(16):
+    _mask = sum(0x80 << (8 * (3 - i)) for i in range(4) if _cont >> i & 1)
+    _size = 1
+    while _size < 4 and _cont >> (_size - 1) & 1:
+        _size += 1
+    if _cont >> (_size - 1) & 1:
+        continue # more than 4 bytes, invalid
+    _VLQ_SHAPES[_mask] = (_size, 8 * (4 - _size))
+del _cont, _mask, _size
+
+
 class MIDIError(Exception):
     """Generic exception for errors reading a MIDI file."""
     pass
 
 
+def _read_vlq(buf, pos):
+    """
+    Decodes the variable length int starting at `pos` in `buf`.
+    
+    Returns the value and the number of bytes it took up.
+    """
+    # Most variable ints are a single byte, so skip the table for those
+    value = buf[pos]
+    if value < 0x80:
+        return value, 1
+    if len(buf) - pos >= 4:
+        word = _VLQ_WINDOW.unpack_from(buf, pos)[0]
+    else:
+        word = int.from_bytes(bytes(buf[pos:pos+4]).ljust(4, _ZERO_BYTE), byteorder="big")
+    try:
+        size, shift = _VLQ_SHAPES[word & 0x80808080]
+    except KeyError:
+        raise MIDIError("That file has a variable length int longer than 4 bytes, which the filetype spec does not allow.")
+    word >>= shift
+    # Pack the 7 bit groups of each byte together
+    value = (
+        (word & 0x7F)
+        | (word >> 1 & 0x3F80)
+        | (word >> 2 & 0x1FC000)
+        | (word >> 3 & 0xFE00000)
+    )
+    return value, size
+
+
+def _encode_vlq(value):
+    """Encodes `value` as a variable length int."""
+    # Build it backwards, the last byte is the only one without the high bit
+    vlq = bytearray((value & 0b1111111,))
+    value = value >> 7
+    while value:
+        vlq.append(value & 0b1111111 | 0b10000000)
+        value = value >> 7
+    vlq.reverse()
+    return bytes(vlq)
+
+
+# Every variable int that fits in 2 bytes, which covers almost all timedeltas
+_VLQ_LUT = [_encode_vlq(value) for value in range(0x4000)]
+
+
+# Short trailing data seen so far, so repeated events like tempo, time signature
+# and controller changes can share one bytes object. This outlives any one file,
+# so only small payloads go in, which caps it at a few hundred KB.
+_INTERNED = {}
+_INTERN_LIMIT = 4096
+_INTERN_MAX_SIZE = 8
+
+
+def _intern(data):
+    """
+    Helper to get a shared copy of some trailing data.
+    Longer data is returned as is, and new data stops being remembered once the limit is hit.
+    Parsers check `_INTERNED` themselves first, so the common hit skips this call.
+    """
+    if len(data) > _INTERN_MAX_SIZE:
+        return data
+    if len(_INTERNED) < _INTERN_LIMIT:
+        return _INTERNED.setdefault(data, data)
+    return _INTERNED.get(data, data)
+
+
+def _parse_invalid(event, buf, pos):
+    """Event parser for event types that are not in the filetype spec."""
+    raise MIDIError("That file has an invalid MIDI event type, and I couldn't figure out how to ignore those as indicated in the filetype spec.")
+
+
+def _parse_note(event, buf, pos):
+    """Event parser for note off and note on events."""
+    event.note = buf[pos]
+    event.velocity = buf[pos+1]
+    event.channel = event._event_info & 0b1111
+    event._trailing_ignore = _EMPTY
+    return pos + 2
+
+
+def _parse_ignore_1(event, buf, pos):
+    """Event parser for events with one data byte we don't support."""
+    event.note = None
+    event.velocity = None
+    event.channel = None
+    data = bytes(buf[pos:pos+1])
+    event._trailing_ignore = _INTERNED.get(data) or _intern(data)
+    return pos + 1
+
+
+def _parse_ignore_2(event, buf, pos):
+    """Event parser for events with two data bytes we don't support."""
+    event.note = None
+    event.velocity = None
+    event.channel = None
+    data = bytes(buf[pos:pos+2])
+    event._trailing_ignore = _INTERNED.get(data) or _intern(data)
+    return pos + 2
+
+
+def _parse_system(event, buf, pos):
+    """Event parser for sysex and meta events, which have extra stuff to ignore."""
+    start = pos
+    if event._event_info & 0b1111 == 0xF:
+        # Ignore meta event type
+        pos += 1
+    # Figure out how much to ignore, skipping the call for single byte lengths
+    ignore_num = buf[pos]
+    if ignore_num < 0x80:
+        pos += 1 + ignore_num
+    else:
+        ignore_num, size = _read_vlq(buf, pos)
+        pos += size + ignore_num
+    event.note = None
+    event.velocity = None
+    event.channel = None
+    data = bytes(buf[start:pos])
+    event._trailing_ignore = _INTERNED.get(data) or _intern(data)
+    return pos
+
+
+# Event parsers indexed by the event type, the top 4 bits of the event info
+_EVENT_PARSERS = (
+    (_parse_invalid,) * 8
+    + (_parse_note, _parse_note)  # 0x8, 0x9
+    + (_parse_ignore_2, _parse_ignore_2)  # 0xA, 0xB
+    + (_parse_ignore_1, _parse_ignore_1)  # 0xC, 0xD
+    + (_parse_ignore_2,)  # 0xE
+    + (_parse_system,)  # 0xF
+)
+
+
 class MidiFile():
     """
     Represents a .mid file as an object.
     
     Contains header information and at least one MidiTrack.
     """
+    __slots__ = (
+        "_length",
+        "format",
+        "_num_tracks",
+        "_division",
+        "division_type",
+        "per_quarter_note",
+        "_trailing",
+        "tracks",
+    )
+
     def __init__(self, f):
-        header = f.read(4)
+        # Read the whole file once and parse out of the buffer
+        buf = memoryview(f.read())
+        (
+            header,
+            self._length,
+            self.format,
+            self._num_tracks,
+            self._division,
+        ) = _FILE_HDR.unpack_from(buf, 0)
         assert header == b'MThd'
-        self._length = int.from_bytes(f.read(4), byteorder="big")
         assert self._length >= 6
-        self.format = int.from_bytes(f.read(2), byteorder="big")
-        self._num_tracks = int.from_bytes(f.read(2), byteorder="big")
-        self._division = int.from_bytes(f.read(2), byteorder="big")
         self.division_type = self._division >> 15 & 1
         if self.division_type == 1:
             raise MIDIError("That file determines time using seconds instead of beats, and doing math with time is hard.")
         self.per_quarter_note = self._division & 0b11111111111111
         # Flush out extra header info we don't support
-        self._trailing = bytes(0)
+        self._trailing = _EMPTY
+        pos = 8 + self._length
         if self._length > 6:
-            self._trailing = f.read(self._length - 6)
-        self.tracks = [MidiTrack(f) for x in range(self._num_tracks)]
+            self._trailing = bytes(buf[_FILE_HDR.size:pos])
+        self.tracks = []
+        for x in range(self._num_tracks):
+            track = MidiTrack.__new__(MidiTrack)
+            pos = track._parse(buf, pos)
+            self.tracks.append(track)
     
     def to_file(self):
         """Converts this file and all of its tracks into bytes data."""
-        result = (
-            b'MThd'
-            + self._length.to_bytes(4, byteorder="big")
-            + self.format.to_bytes(2, byteorder="big")
-            + self._num_tracks.to_bytes(2, byteorder="big")
-            + self._division.to_bytes(2, byteorder="big")
-            + self._trailing
-        )
+        result = bytearray(self._header())
+        for track in self.tracks:
+            track.write_into(result)
+        return bytes(result)
+    
+    def write(self, f):
+        """Writes this file and all of its tracks to a binary file object, one track at a time."""
+        f.write(self._header())
         for track in self.tracks:
-            result += track.to_file()
-        return result
+            track.write(f)
+    
+    def _header(self):
+        """Helper to get the bytes data for the header chunk."""
+        return _FILE_HDR.pack(
+            b'MThd',
+            self._length,
+            self.format,
+            self._num_tracks,
+            self._division,
+        ) + self._trailing
 
     def __repr__(self):
         """Pretty print this object for debugging."""
@@ -61,27 +248,57 @@ class MidiTrack():
     
     Contains at least one MidiEvent.
     """
-    def __init__(self, f):
-        header = f.read(4)
+    __slots__ = ("events", "_note_events")
+
+    def __init__(self, buf, pos):
+        # Parsers that need to know where this ends call `_parse` themselves
+        self._parse(buf, pos)
+    
+    def _parse(self, buf, pos):
+        """
+        Helper to fill in this track from the buffer starting at `pos`.
+        Returns the position just after the track.
+        """
+        header, length = _TRACK_HDR.unpack_from(buf, pos)
         assert header == b'MTrk'
         self.events = []
-        length = int.from_bytes(f.read(4), byteorder="big")
-        while length:
-            event = MidiEvent(f)
+        pos += _TRACK_HDR.size
+        end = pos + length
+        while pos < end:
+            event = MidiEvent.__new__(MidiEvent)
+            pos = event._parse(buf, pos)
             self.events.append(event)
-            length -= event._length
+        assert pos == end
+        self._index_notes()
+        return pos
+    
+    def _index_notes(self):
+        """
+        Helper to remember which events are notes, so effects can skip the rest.
+        Must be called again whenever `events` is changed.
+        """
+        self._note_events = [event for event in self.events if event.note is not None]
     
     def to_file(self):
         """Converts this track and all of its events into bytes data."""
-        result = bytes(0)
+        result = bytearray()
+        self.write_into(result)
+        return bytes(result)
+    
+    def write_into(self, out):
+        """Appends the bytes data for this track and all of its events to a bytearray."""
+        start = len(out)
+        # The header is filled in once all of the events are written
+        out += _EMPTY_TRACK_HDR
         for event in self.events:
-            result += event.to_file()
-        result = (
-            b'MTrk'
-            + len(result).to_bytes(4, byteorder="big")
-            + result
-        )
-        return result
+            event.write_into(out)
+        _TRACK_HDR.pack_into(out, start, b'MTrk', len(out) - start - _TRACK_HDR.size)
+    
+    def write(self, f):
+        """Writes this track and all of its events to a binary file object."""
+        result = bytearray()
+        self.write_into(result)
+        f.write(result)
     
     def __repr__(self):
         """Pretty print this object for debugging."""
@@ -94,86 +311,81 @@ class MidiEvent():
     
     Contains some kind of information, ex. a note being pushed.
     """
-    def __init__(self, f):
-        self._length = 0 # only use in track __init__
-        self.timedelta = 0
-        self.note = None
-        self.velocity = None
-        self.channel = None
-        self._trailing_ignore = bytes(0)
-        # Handle variable int
-        while True:
-            self.timedelta = self.timedelta << 7
-            raw = int.from_bytes(self._read_bytes(f, 1), byteorder="big")
-            self.timedelta += (raw & 0b1111111)
-            if not raw >> 7 & 1:
-                break
-        # Figure out the event to process it
-        self._event_info = int.from_bytes(self._read_bytes(f, 1), byteorder="big")
-        event_type = self._event_info >> 4
-        if event_type == 0xF:
-            event_subtype = self._event_info & 0b1111
-            # This event has extra stuff to ignore
-            if event_subtype == 0xF:
-                # Ignore meta event type
-                self._trailing_ignore += self._read_bytes(f, 1)
-            # Figure out how much to ignore
-            ignore_num = 0
-            while True:
-                ignore_raw = self._read_bytes(f, 1)
-                self._trailing_ignore += ignore_raw
-                ignore_raw = int.from_bytes(ignore_raw, byteorder="big")
-                ignore_num += ignore_raw & 0b1111111
-                if not ignore_raw >> 7 & 1:
-                    break
-            self._trailing_ignore += self._read_bytes(f, ignore_num)
-        elif event_type in (0xA, 0xB, 0xE):
-            self._trailing_ignore += self._read_bytes(f, 2)
-        elif event_type in (0xC, 0xD):
-            self._trailing_ignore += self._read_bytes(f, 1)
-        elif event_type in (0x8, 0x9):
-            self.channel = self._event_info & 0b1111
-            self.note = int.from_bytes(self._read_bytes(f, 1), byteorder="big")
-            self.velocity = int.from_bytes(self._read_bytes(f, 1), byteorder="big")
-        else:
-            raise MIDIError("That file has an invalid MIDI event type, and I couldn't figure out how to ignore those as indicated in the filetype spec.")
+    __slots__ = (
+        "timedelta",
+        "note",
+        "velocity",
+        "channel",
+        "_event_info",
+        "_trailing_ignore",
+    )
+
+    def __init__(self, buf, pos):
+        # Parsers that need to know where this ends call `_parse` themselves
+        self._parse(buf, pos)
     
-    def _read_bytes(self, f, number):
+    def _parse(self, buf, pos):
         """
-        Helper to read some number of bytes while updating 
-        the internal counter of the number of bytes read.
+        Helper to fill in this event from the buffer starting at `pos`.
+        Returns the position just after the event.
         """
-        self._length += number
-        return f.read(number)
+        # Handle variable int, skipping the call for single byte timedeltas
+        timedelta = buf[pos]
+        if timedelta < 0x80:
+            self.timedelta = timedelta
+            pos += 1
+        else:
+            self.timedelta, size = _read_vlq(buf, pos)
+            pos += size
+        # Figure out the event to process it
+        self._event_info = buf[pos]
+        return _EVENT_PARSERS[self._event_info >> 4](self, buf, pos + 1)
+    
+    @staticmethod
+    def _clone_note(src, timedelta, note):
+        """Helper to quickly copy a note event with a new timedelta and note."""
+        event = MidiEvent.__new__(MidiEvent)
+        event.timedelta = timedelta
+        event.note = note
+        event.velocity = src.velocity
+        event.channel = src.channel
+        event._event_info = src._event_info
+        event._trailing_ignore = src._trailing_ignore
+        return event
     
     def to_file(self):
         """Converts this event into bytes data."""
+        result = bytearray()
+        self.write_into(result)
+        return bytes(result)
+    
+    def write_into(self, out):
+        """Appends the bytes data for this event to a bytearray."""
         td = self.timedelta
-        result = bytes(0)
-        is_first = True
-        while td:
-            next_byte = td & 0b1111111
-            if not is_first:
-                next_byte = next_byte | 0b10000000
-            is_first = False
-            td = td >> 7
-            result = next_byte.to_bytes(1, byteorder="big") + result
-        
-        if len(result) == 0:
-            result = bytes(1)
-        
-        result += self._event_info.to_bytes(1, byteorder="big")
+        if td < 0x80:
+            # Most timedeltas fit in one byte
+            out.append(td)
+        else:
+            out += _VLQ_LUT[td] if td < len(_VLQ_LUT) else _encode_vlq(td)
+        out.append(self._event_info)
         if self.note is not None:
-            result += self.note.to_bytes(1, byteorder="big")
-            result += self.velocity.to_bytes(1, byteorder="big")
-        result += self._trailing_ignore
-        return result
+            out.append(self.note)
+            out.append(self.velocity)
+        out += self._trailing_ignore
 
     def __repr__(self):
         """Pretty print this object for debugging."""
         return f"MidiEvent(timedelta={self.timedelta}, note={self.note}, velocity={self.velocity})"
 
 
+def _shift_table(amount):
+    """
+    Helper to work out every note shifted by `amount` half steps, clamped
+    to the valid range, so effects can look notes up instead of clamping.
+    """
+    return [max(0, min(127, note + amount)) for note in range(256)]
+
+
 def pitch(midi, tracks):
     """Modifies the pitch of all notes in a midi file."""
     while True:
@@ -191,11 +403,10 @@ def pitch(midi, tracks):
         except ValueError:
             print("That is not a valid option.")
             continue
+        shifted = _shift_table(amount)
         for track in tracks:
-            for event in track.events:
-                if event.note is None:
-                    continue
-                event.note = max(0, min(127, event.note + amount))
+            for event in track._note_events:
+                event.note = shifted[event.note]
         print("Pitch shift applied.")
         break
         
@@ -220,7 +431,7 @@ def velocity(midi, tracks):
             print("The velocity value must be between 1 and 127.")
             continue
         for track in tracks:
-            for event in track.events:
+            for event in track._note_events:
                 if not event.velocity:
                     continue
                 event.velocity = amount
@@ -249,16 +460,18 @@ def chorus(midi, tracks):
                 print("That is not a valid option.")
                 continue
             processed.append(note)
+        tables = [_shift_table(pitch) for pitch in reversed(processed)]
         for track in tracks:
-            for idx in range(len(track.events)-1, -1, -1):
-                event = track.events[idx]
+            # Rebuild the event list in one pass rather than inserting into it
+            new_events = []
+            for event in track.events:
+                new_events.append(event)
                 if event.note is None:
                     continue
-                for pitch in processed:
-                    new_event = copy.copy(event)
-                    new_event.timedelta = 0
-                    new_event.note = max(0, min(127, event.note + pitch))
-                    track.events.insert(idx + 1, new_event)
+                for shifted in tables:
+                    new_events.append(MidiEvent._clone_note(event, 0, shifted[event.note]))
+            track.events = new_events
+            track._index_notes()
         print("Chorus added.")
         break
 
@@ -289,26 +502,37 @@ def delay(midi, tracks):
             ticks = int(midi.per_quarter_note * quarters)
             processed.append(ticks)
         for track in tracks:
-            for idx in range(len(track.events)-1, -1, -1):
-                event = track.events[idx]
+            # Absolute time of each event, in ticks from the start of the track
+            times = list(itertools.accumulate(event.timedelta for event in track.events))
+            # Every event's time depends on all of the events before it, so this walks
+            # the whole track rather than just the note events.
+            delays = []
+            for event_time, event in zip(reversed(times), reversed(track.events)):
                 if event.note is None:
                     continue
                 for ticks in processed:
-                    after = track.events[idx+1:]
-                    # Sets `i` to equal the number of events after `idx` where the delay event should go.
-                    # Sets `ticks` to equal the number of ticks after the last event.
-                    for i, aftertrack in enumerate(after, 1):
-                        if aftertrack.timedelta > ticks:
-                            break
-                        ticks -= aftertrack.timedelta
-                    else:
-                        i += 1
-                    new_event = copy.copy(event)
-                    new_event.timedelta = ticks
-                    # Fixes the timedelta for the event after the event we are adding.
-                    if len(track.events) > idx + i:
-                        track.events[idx + i].timedelta -= ticks
-                    track.events.insert(idx + i, new_event)
+                    delays.append((event_time + ticks, event))
+            # Delays landing on the same tick keep the order they were added in,
+            # and go after any existing events on that tick.
+            delays.sort(key=operator.itemgetter(0))
+            # Merge the delays into the track in one pass, fixing up timedeltas as we go
+            new_events = []
+            last_time = 0
+            delay_idx = 0
+            for event_time, event in zip(times, track.events):
+                while delay_idx < len(delays) and delays[delay_idx][0] < event_time:
+                    delay_time, src = delays[delay_idx]
+                    new_events.append(MidiEvent._clone_note(src, delay_time - last_time, src.note))
+                    last_time = delay_time
+                    delay_idx += 1
+                event.timedelta = event_time - last_time
+                last_time = event_time
+                new_events.append(event)
+            for delay_time, src in delays[delay_idx:]:
+                new_events.append(MidiEvent._clone_note(src, delay_time - last_time, src.note))
+                last_time = delay_time
+            track.events = new_events
+            track._index_notes()
         print("Delay added.")
         break
 
@@ -350,9 +574,8 @@ if __name__ == "__main__":
             elif track == "b":
                 break
             elif track == "s":
-                result = midi.to_file()
                 with open(f"output-{int(time.time())}.mid", "wb") as f:
-                    f.write(result)
+                    midi.write(f)
                 print("File saved.")
                 continue
             else:
@@ -390,9 +613,8 @@ if __name__ == "__main__":
                 elif option == "b":
                     break
                 elif option == "s":
-                    result = midi.to_file()
                     with open(f"output-{int(time.time())}.mid", "wb") as f:
-                        f.write(result)
+                        midi.write(f)
                     print("File saved.")
                     continue
                 elif option == "p":